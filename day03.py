@@ -54,9 +54,11 @@ other claim. If you can somehow draw attention to it, maybe the Elves will be ab
 For example, in the claims above, only claim 3 is intact after all claims are made.
 """
 
-from PIL import Image
+import collections
 
-from utils import ProblemSolver
+import numpy
+
+from utils import ProblemSolver, parseIntegers
 
 
 class Claim(object):
@@ -71,10 +73,392 @@ class Claim(object):
     def area(self):
         return self.w * self.h
 
+    def overlaps(self, other):
+        """
+        :param other: another Claim
+        :return: if the two claims share at least one square inch
+        """
+        return self.sharedArea(other) > 0
+
+    def sharedArea(self, other):
+        """
+        :param other: another Claim
+        :return: how many square inches the two claims share
+        """
+        w = min(self.x + self.w, other.x + other.w) - max(self.x, other.x)
+        h = min(self.y + self.h, other.y + other.h) - max(self.y, other.y)
+        return max(0, w) * max(0, h)
+
     def __str__(self):
         return '#{} @ {},{}: {}x{}'.format(self.id, self.x, self.y, self.w, self.h)
 
 
+ClaimType = numpy.dtype([('id', numpy.int64), ('x', numpy.int64), ('y', numpy.int64),
+                         ('w', numpy.int64), ('h', numpy.int64)])
+
+
+def parseClaims(buffer):
+    """
+    Parse a whole claims file at once. Every claim line is just five numbers with some punctuation around them,
+    so this pulls every number out of the text at once with parseIntegers, rather than splitting the text up line
+    by line
+
+    :param buffer: the claims text as a str, bytes, or an array of bytes, like a numpy.memmap of the file
+    :return: structured numpy array of ClaimType, one record per claim
+    """
+    numbers = parseIntegers(buffer)
+    numbers = numbers.reshape((-1, len(ClaimType.names)))
+
+    claims = numpy.zeros(len(numbers), dtype=ClaimType)
+    for i, name in enumerate(ClaimType.names):
+        claims[name] = numbers[:, i]
+
+    return claims
+
+
+class ClaimArray(object):
+    """
+    List-like wrapper around a structured array of claims, that only makes Claim objects for the claims that
+    are actually looked at
+    """
+    def __init__(self, records):
+        """
+        :param records: structured numpy array of ClaimType
+        """
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        record = self.records[index]
+        return Claim(int(record['id']), int(record['x']), int(record['y']), int(record['w']), int(record['h']))
+
+    def __iter__(self):
+        for i in range(len(self.records)):
+            yield self[i]
+
+
+def claimFields(claims):
+    """
+    :param claims: list of Claim objects, or a ClaimArray
+    :return: tuple of int64 arrays of the claims' (x, y, w, h), straight from the records if there are any
+    """
+    if isinstance(claims, ClaimArray):
+        return tuple(claims.records[name] for name in ('x', 'y', 'w', 'h'))
+
+    return tuple(numpy.array([getattr(claim, name) for claim in claims], dtype=numpy.int64)
+                 for name in ('x', 'y', 'w', 'h'))
+
+
+class ClaimIndex(object):
+    """
+    Uniform grid of buckets over the fabric, where each bucket holds the claims that touch it, so finding what a
+    claim overlaps only means looking at the claims in the buckets it touches
+    """
+    def __init__(self, claims, bucketSize=None):
+        """
+        :param claims: list of Claim objects
+        :param bucketSize: how many inches across each bucket is, defaults to the average claim's longest side
+        """
+        self.claims = [claim for claim in claims if claim.area > 0]
+
+        if bucketSize is None:
+            sides = [max(claim.w, claim.h) for claim in self.claims]
+            bucketSize = max(1, sum(sides) // max(1, len(sides)))
+
+        self.bucketSize = bucketSize
+        self.buckets = collections.defaultdict(list)
+
+        for claim in self.claims:
+            self.addToBuckets(claim)
+
+    def addToBuckets(self, claim):
+        """
+        :param claim: a Claim to put in every bucket it touches
+        """
+        for bucket in self.bucketsFor(claim):
+            self.buckets[bucket].append(claim)
+
+    def removeFromBuckets(self, claim):
+        """
+        :param claim: a Claim to take back out of every bucket it touches
+        """
+        for bucket in self.bucketsFor(claim):
+            self.buckets[bucket].remove(claim)
+            if not self.buckets[bucket]:
+                del self.buckets[bucket]
+
+    def bucketsFor(self, claim):
+        """
+        :param claim: a Claim
+        :return: generator of the (column, row) of every bucket the claim touches
+        """
+        left, top = claim.x // self.bucketSize, claim.y // self.bucketSize
+        right = (claim.x + claim.w - 1) // self.bucketSize
+        bottom = (claim.y + claim.h - 1) // self.bucketSize
+
+        for column in range(left, right + 1):
+            for row in range(top, bottom + 1):
+                yield column, row
+
+    def overlapping(self, claim):
+        """
+        :param claim: a Claim
+        :return: list of the other claims in the index that share at least one square inch with it
+        """
+        found = {}
+        for bucket in self.bucketsFor(claim):
+            for other in self.buckets.get(bucket, []):
+                if other is not claim and other.id not in found and claim.overlaps(other):
+                    found[other.id] = other
+
+        return list(found.values())
+
+    def intact(self):
+        """
+        :return: list of the claims that don't overlap any other claim
+        """
+        overlapped = set()
+
+        # every overlapping pair shares at least one bucket, so only pairs within a bucket need checking
+        for bucket in self.buckets.values():
+            for i, claim in enumerate(bucket):
+                for other in bucket[i + 1:]:
+                    if claim.overlaps(other):
+                        overlapped.add(claim.id)
+                        overlapped.add(other.id)
+
+        return [claim for claim in self.claims if claim.id not in overlapped]
+
+
+class Fabric(object):
+    """
+    A piece of fabric that claims can be added to and withdrawn from one at a time, keeping the overlapped area
+    and the set of intact claims up to date as it goes rather than rebuilding everything from the claim list
+    """
+    def __init__(self, bucketSize=32):
+        """
+        :param bucketSize: how many inches across each bucket of the spatial index is
+        """
+        self.claims = {}
+        self.index = ClaimIndex([], bucketSize=bucketSize)
+
+        # how many claims cover each square inch, keyed by (x, y) and only holding the inches some claim covers
+        self.counts = collections.Counter()
+
+        # how many square inches of each claim are shared with other claims, summed over every other claim
+        self.shared = {}
+
+        self.overlappedArea = 0
+        self.intact = set()
+
+    @staticmethod
+    def squares(claim):
+        """
+        :param claim: a Claim
+        :return: generator of the (x, y) of every square inch the claim covers
+        """
+        for x in range(claim.x, claim.x + claim.w):
+            for y in range(claim.y, claim.y + claim.h):
+                yield x, y
+
+    def addClaim(self, claim):
+        """
+        Lay a claim down on the fabric
+
+        :param claim: the Claim to add
+        """
+        if claim.id in self.claims:
+            raise ValueError("Claim {} is already on the fabric".format(claim.id))
+
+        for square in self.squares(claim):
+            self.counts[square] += 1
+
+            # a square inch that just went from one claim to two is newly overlapped
+            if self.counts[square] == 2:
+                self.overlappedArea += 1
+
+        self.shared[claim.id] = 0
+        for other in self.index.overlapping(claim):
+            area = claim.sharedArea(other)
+            self.shared[claim.id] += area
+            self.shared[other.id] += area
+            self.intact.discard(other.id)
+
+        if claim.area and not self.shared[claim.id]:
+            self.intact.add(claim.id)
+
+        self.claims[claim.id] = claim
+        if claim.area:
+            self.index.addToBuckets(claim)
+
+    def removeClaim(self, idNumber):
+        """
+        Withdraw a claim from the fabric
+
+        :param idNumber: the id of the claim to remove
+        :return: the Claim that was removed
+        """
+        if idNumber not in self.claims:
+            raise KeyError("Claim {} is not on the fabric".format(idNumber))
+
+        claim = self.claims.pop(idNumber)
+        if claim.area:
+            self.index.removeFromBuckets(claim)
+
+        for square in self.squares(claim):
+            # a square inch that's about to go from two claims to one isn't overlapped anymore
+            if self.counts[square] == 2:
+                self.overlappedArea -= 1
+
+            self.counts[square] -= 1
+            if not self.counts[square]:
+                del self.counts[square]
+
+        for other in self.index.overlapping(claim):
+            self.shared[other.id] -= claim.sharedArea(other)
+            if not self.shared[other.id]:
+                self.intact.add(other.id)
+
+        del self.shared[claim.id]
+        self.intact.discard(claim.id)
+
+        return claim
+
+
+def claimCounts(claims):
+    """
+    Build a grid of how many claims cover each square inch of fabric.
+
+    Each claim adds one at its top left corner and takes one away just past each of its other corners in a
+    difference grid, then summing the difference grid along both axes fills in every claim's rectangle at once
+
+    :param claims: list of Claim objects, or a ClaimArray
+    :return: int32 array shaped (height, width) of the claim count at each square inch, big enough to fit every claim
+    """
+    xs, ys, ws, hs = claimFields(claims)
+    rights = xs + ws
+    bottoms = ys + hs
+
+    width = int(rights.max()) if len(claims) else 0
+    height = int(bottoms.max()) if len(claims) else 0
+
+    difference = numpy.zeros((height + 1, width + 1), dtype=numpy.int32)
+    numpy.add.at(difference, (ys, xs), 1)
+    numpy.add.at(difference, (ys, rights), -1)
+    numpy.add.at(difference, (bottoms, xs), -1)
+    numpy.add.at(difference, (bottoms, rights), 1)
+
+    # sum in place, cumsum would otherwise promote to int64 and make two full size copies
+    difference.cumsum(axis=0, out=difference)
+    difference.cumsum(axis=1, out=difference)
+
+    return difference[:height, :width]
+
+
+class CoverageTree(object):
+    """
+    Segment tree over the gaps between a sorted list of y values, that keeps track of how much of the y axis is
+    covered by at least one, and at least two, of the intervals that have been added to it
+    """
+    def __init__(self, ys):
+        """
+        :param ys: sorted list of the unique y values that intervals can start and end at
+        """
+        self.ys = ys
+        size = 4 * max(1, len(ys))
+        self.count = [0] * size
+        self.once = [0] * size
+        self.twice = [0] * size
+
+    def update(self, start, stop, delta, node=1, low=0, high=None):
+        """
+        Add (or remove) cover over the gaps between ys[start] and ys[stop]
+
+        :param start: index into ys of the start of the interval
+        :param stop: index into ys of the end of the interval
+        :param delta: 1 to add an interval, -1 to remove it
+        """
+        if high is None:
+            high = len(self.ys) - 1
+
+        if stop <= low or high <= start:
+            return
+
+        if start <= low and high <= stop:
+            self.count[node] += delta
+        else:
+            middle = (low + high) // 2
+            self.update(start, stop, delta, node * 2, low, middle)
+            self.update(start, stop, delta, node * 2 + 1, middle, high)
+
+        self.pull(node, low, high)
+
+    def pull(self, node, low, high):
+        """
+        Work out how much of this node's span is covered once and twice from its own count and its children
+        """
+        full = self.ys[high] - self.ys[low]
+        isLeaf = high - low == 1
+
+        childOnce = 0 if isLeaf else self.once[node * 2] + self.once[node * 2 + 1]
+        childTwice = 0 if isLeaf else self.twice[node * 2] + self.twice[node * 2 + 1]
+
+        if self.count[node] >= 2:
+            self.once[node] = full
+            self.twice[node] = full
+        elif self.count[node] == 1:
+            self.once[node] = full
+            self.twice[node] = childOnce
+        else:
+            self.once[node] = childOnce
+            self.twice[node] = childTwice
+
+    @property
+    def overlapped(self):
+        """
+        :return: the length of the y axis covered by two or more intervals
+        """
+        return self.twice[1]
+
+
+def overlapArea(claims):
+    """
+    Sweep a line across the fabric from left to right, adding each claim's y interval to a coverage tree when the
+    line reaches its left edge and taking it away at its right edge. Between two edges the overlapped length
+    doesn't change, so the overlapped area is built up one strip at a time, and only the claim edges are ever
+    stored, no matter how big the fabric is
+
+    :param claims: list of Claim objects
+    :return: the number of square inches covered by two or more claims
+    """
+    claims = [claim for claim in claims if claim.w > 0 and claim.h > 0]
+    if not claims:
+        return 0
+
+    ys = sorted(set([claim.y for claim in claims] + [claim.y + claim.h for claim in claims]))
+    yIndex = {y: i for i, y in enumerate(ys)}
+
+    # removals sort before additions at the same x, since the claims are half open
+    events = []
+    for claim in claims:
+        events.append((claim.x, 1, yIndex[claim.y], yIndex[claim.y + claim.h]))
+        events.append((claim.x + claim.w, -1, yIndex[claim.y], yIndex[claim.y + claim.h]))
+    events.sort()
+
+    tree = CoverageTree(ys)
+    area = 0
+    lastX = events[0][0]
+
+    for x, delta, start, stop in events:
+        area += tree.overlapped * (x - lastX)
+        tree.update(start, stop, delta)
+        lastX = x
+
+    return area
+
+
 class Day03Solver(ProblemSolver):
     def __init__(self):
         super(Day03Solver, self).__init__(3)
@@ -82,33 +466,33 @@ class Day03Solver(ProblemSolver):
         self.testDataPartOne = {'#1 @ 1,3: 4x4\n#2 @ 3,1: 4x4\n#3 @ 5,5: 2x2': 4}
         self.testDataPartTwo = {'#1 @ 1,3: 4x4\n#2 @ 3,1: 4x4\n#3 @ 5,5: 2x2': 3}
 
-        self.image = None
+        # fabric bigger than this many square inches gets swept instead of built as a grid
+        self.maxGridArea = 1 << 26
+
+        # set this to parse the input file straight out of a memory map instead of loading the text
+        self.memoryMap = False
 
     def ProcessInput(self, data=None):
         """
+        Parse all the claims in one pass into a ClaimArray
 
         :param data:
-        :return:
+        :return: ClaimArray of every claim
         """
         if not data:
-            data = self.rawData
-
-        processed = []
+            if self.memoryMap:
+                data = numpy.memmap(self.filePath, dtype=numpy.uint8, mode='r')
+            else:
+                data = self.rawData
 
-        for claim in data.split('\n'):
-            idNum = int(claim.split(' @ ')[0].replace('#',''))
-            coords, size = claim.split(' @ ')[-1].split(': ')
-            x, y = [int(i) for i in coords.split(',')]
-            w, h = [int(i) for i in size.split('x')]
-
-            processed.append(Claim(idNum, x, y, w, h))
-
-        return processed
+        return ClaimArray(parseClaims(data))
 
     def SolvePartOne(self, data=None):
         """
-        loops over the claim data, and adds a value of 1 to each pixel in the claim
-        returns the number of pixels whose value is greater than 1
+        builds a grid of how many claims cover each square inch
+        returns the number of square inches covered by more than one claim
+
+        if the fabric is too big for a grid, sweep over the claims' edges instead
 
         :param data:
         :return:
@@ -116,62 +500,30 @@ class Day03Solver(ProblemSolver):
         if not data:
             data = self.processed
 
-        image = Image.new('L', (1000, 1000))
-
-        for claim in data:
-            for w in range(claim.w):
-                for h in range(claim.h):
-                    x, y = w + claim.x, h + claim.y
-                    currentValue = image.getpixel((x, y))
-                    currentValue += 1
-                    image.putpixel((x, y), currentValue)
+        xs, ys, ws, hs = claimFields(data)
+        width = int((xs + ws).max()) if len(data) else 0
+        height = int((ys + hs).max()) if len(data) else 0
+        if width * height > self.maxGridArea:
+            return overlapArea(data)
 
-        counter = 0
+        counts = claimCounts(data)
 
-        for x in range(image.width):
-            for y in range(image.height):
-                val = image.getpixel((x, y))
-                if val > 1:
-                    counter += 1
-
-        print("stashing off image to local instance")
-        self.image = image
-
-        return counter
-
-    def CheckIfClaimIsClean(self, image, claim):
-        """
-        Loop over all the pixels in the claim and return False if any value in the claim > 1
-        """
-        print(claim)
-        for w in range(claim.w):
-            for h in range(claim.h):
-                x = claim.x + w
-                y = claim.y + h
-                print(x, y)
-                if image.getpixel((x, y)) > 1:
-                    return False
-
-        return True
+        return int((counts > 1).sum())
 
     def SolvePartTwo(self, data=None):
         """
+        finds the claim that doesn't overlap any other claim using a spatial index of the claims
 
         :param data:
-        :return:
+        :return: the id of the intact claim
         """
         if not data:
             data = self.processed
 
-        # make sure we have an image to operate on
-        self.SolvePartOne(data=data)
-
-        # use the solver in part 1, that stores off an image of pixels, and get it out of part one
-        image = self.image
+        intact = ClaimIndex(data).intact()
 
-        for claim in data:
-            if self.CheckIfClaimIsClean(image, claim):
-                return claim.id
+        if intact:
+            return intact[0].id
 
 
 if __name__ == '__main__':
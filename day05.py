@@ -33,27 +33,89 @@ Speedups:
 -- You can go in reverse through the polymer so you don't have to move quite as much
 -- Then when you're resolving the polymer you know you can first try to react the stuff that you just collapsed
 """
+import collections
+import concurrent.futures
+import os
 import string
 
 from utils import ProblemSolver
 
 
-class Polymer(list):
+def reacts(a, b):
     """
-    A subclass of list that takes in a string of capital and lower case letters, and stores them as
-    positive and negative integers to aid in properly resolve the polymer chain
+    Two units react when they're the same letter with opposite capitalization, and since upper and lower case
+    ASCII letters only differ by the 0x20 bit, that's the only bit that can differ between them
+
+    :param a: ASCII code of the first unit
+    :param b: ASCII code of the second unit
+    :return: if the two units destroy each other
+    """
+    return a ^ b == 0x20
+
+
+def react(units, stack=None):
+    """
+    Push units onto a stack of unreacted units one at a time. Each unit either destroys the unit on top of the
+    stack or gets pushed onto it, so every unit is only looked at once
+
+    :param units: bytes-like sequence of ASCII units to react
+    :param stack: bytearray of already reacted units to continue from, so chunks can be fed in one after another
+    :return: the stack of units that are left over
+    """
+    if stack is None:
+        stack = bytearray()
+
+    for unit in units:
+        # reacts() inlined, since this is the hot loop
+        if stack and stack[-1] ^ unit == 0x20:
+            stack.pop()
+        else:
+            stack.append(unit)
+
+    return stack
+
+
+def reactChunk(units):
+    """
+    Fully react one chunk of a larger polymer in a worker, handing back what's left of the chunk as plain bytes
+    ready to be merged onto the reacted units so far
+
+    :param units: bytes of the chunk
+    :return: bytes of whatever is left of the chunk after reacting
+    """
+    return bytes(react(units))
+
+
+def mergeRemainder(stack, remainder):
+    """
+    Merge an already reacted chunk onto the end of the stack. The chunk can't react with itself, so only its
+    start can cancel out the end of the stack
+
+    :param stack: bytearray of the reacted units so far, updated in place
+    :param remainder: bytes of a reacted chunk
     """
+    j = 0
+    while j < len(remainder) and stack and stack[-1] ^ remainder[j] == 0x20:
+        stack.pop()
+        j += 1
 
-    # store off some class properties to make it easier to access these later
-    LetterMap = {string.ascii_uppercase[i]: i + 1 for i in range(len(string.ascii_uppercase))}
-    LetterMap.update({string.ascii_lowercase[i]: -1 * (i + 1) for i in range(len(string.ascii_lowercase))})
-    NumberMap = {v: k for k, v in LetterMap.items()}
+    stack += remainder[j:]
+
+
+class Polymer(bytearray):
+    """
+    A subclass of bytearray that takes in a string of capital and lower case letters, and stores the ASCII code of
+    each unit in a single byte, so converting to and from strings is a straight encode and decode
+    """
+
+    # line endings and other whitespace in the input aren't units
+    Whitespace = b' \t\r\n'
 
     def __init__(self, inString, *args, **kwargs):
-        super(Polymer, self).__init__(*args, **kwargs)
+        if isinstance(inString, str):
+            inString = inString.encode('ascii')
 
-        for i in inString:
-            self.append(Polymer.LetterMap[i])
+        super(Polymer, self).__init__(bytes(inString).translate(None, Polymer.Whitespace), *args, **kwargs)
 
     def resolveAll(self):
         """
@@ -80,7 +142,7 @@ class Polymer(list):
         """
         Tries to resolve the polymer component and index and the index next to it
 
-        If the sum of the two components is 0, we know we can resolve the away these two components
+        If the two components react, we know we can resolve the away these two components
 
         :param index: where we should check
         :return: the index to check next (the same index if something was resolved
@@ -88,7 +150,7 @@ class Polymer(list):
         """
         # make sure we can check the next item (if index + 1 > len(self) then we're out of range
         if index < len(self) - 1:
-            if (self[index] + self[index + 1]) == 0:
+            if reacts(self[index], self[index + 1]):
 
                 # pop out the next item
                 self.pop(index + 1)
@@ -99,11 +161,91 @@ class Polymer(list):
 
         return index + 1
 
+    def reduce(self):
+        """
+        Fully react the polymer in a single pass by keeping a stack of the units that haven't reacted yet
+
+        :return: the length of the fully reacted polymer
+        """
+        self[:] = react(self)
+
+        return len(self)
+
+    @classmethod
+    def fromStream(cls, fh, blockSize=1 << 20):
+        """
+        Build an already reacted Polymer by reading a file in fixed-size blocks and pushing each block through the
+        stack of unreacted units, so only the reacted polymer and one block are ever held in memory
+
+        :param fh: file object opened in binary mode
+        :param blockSize: how many bytes to read at a time
+        :return: the fully reacted Polymer
+        """
+        stack = bytearray()
+
+        block = fh.read(blockSize)
+        while block:
+            react(block.translate(None, Polymer.Whitespace), stack)
+            block = fh.read(blockSize)
+
+        return cls(stack)
+
+    def reduceChunked(self, chunkSize, workers=None):
+        """
+        Fully react the polymer by splitting it into chunks, reacting each chunk on its own in a process pool,
+        and then merging the left over units of each chunk in order.
+
+        Reacting is associative, so a reduced chunk can't react inside itself anymore, and merging it in only has
+        to cancel units where it meets the end of the stack so far, then tack the rest on in one go
+
+        :param chunkSize: how many units go into each chunk
+        :param workers: how many processes to use, None uses every core
+        :return: the length of the fully reacted polymer
+        """
+        chunks = (bytes(self[i:i + chunkSize]) for i in range(0, len(self), chunkSize))
+
+        # Executor.map would copy out every chunk up front, so only keep a few chunks in flight at a time
+        inFlight = 2 * (workers or os.cpu_count() or 1)
+
+        stack = bytearray()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = collections.deque()
+            for chunk in chunks:
+                pending.append(pool.submit(reactChunk, chunk))
+                if len(pending) >= inFlight:
+                    mergeRemainder(stack, pending.popleft().result())
+
+            while pending:
+                mergeRemainder(stack, pending.popleft().result())
+
+        self[:] = stack
+
+        return len(self)
+
+    def without(self, letter):
+        """
+        :param letter: the unit type to strip out of the polymer, eg 'a'
+        :return: a new Polymer with both polarities of that unit type removed
+        """
+        return Polymer(self.translate(None, (letter.lower() + letter.upper()).encode('ascii')))
+
     def __str__(self):
         """
         :return: the letter string representing this Polymer
         """
-        return ''.join([Polymer.NumberMap[i] for i in self])
+        return self.decode('ascii')
+
+
+def reactVariant(variant):
+    """
+    Strip one unit type out of a polymer and fully react what's left, for one of the part two variants
+
+    :param variant: tuple of the (bytes) polymer to start from and the letter to strip out of it
+    :return: tuple of the stripped letter and the length of the reduced variant
+    """
+    units, letter = variant
+    polymer = Polymer(units).without(letter)
+    return letter, polymer.reduce()
 
 
 class Day05Solver(ProblemSolver):
@@ -116,63 +258,111 @@ class Day05Solver(ProblemSolver):
         self.testDataPartOne = {'dabAcCaCBAcCcaDA': 10}
         self.testDataPartTwo = {'dabAcCaCBAcCcaDA': 4}
 
+        # how many processes to spread work across, None uses every core
+        self.workers = None
+
+        # set this to react polymers in chunks of this many units across the process pool
+        self.chunkSize = None
+
+        # set this to react the input file block by block as it's read instead of loading all of it
+        self.streaming = False
+
     def ProcessInput(self, data=None):
         """
-        Map our input letters to positive or negative numbers and return them out in a list
+        Pack our input letters into a Polymer
         :param data:
-        :return: a Polymer object based off our input data
+        :return: a Polymer object based off our input data, already reacted if we're streaming the input file
         """
         if not data:
+            if self.streaming:
+                with open(self.filePath, 'rb') as fh:
+                    return Polymer.fromStream(fh)
+
             data = self.rawData
 
         processed = Polymer(data)
 
         return processed
 
-    def SolvePartOne(self, data=None):
+    def SolvePartOne(self, data=None, multiPass=False, chunkSize=None):
         """
         Resolve the reactions in the polymer string until nothing can be resolved
 
         :param data: the Polymer instance to use for resolving all
+        :param multiPass: use the original multi-pass resolveAll approach, kept around as a reference to check
+            the single-pass reduction against
+        :param chunkSize: react the polymer in chunks of this many units across a process pool,
+            defaults to self.chunkSize
         :return: The resulting length of the polymer string
         """
         if not data:
             data = self.processed
 
-        # resolve all until resolveAll returns false because nothing was changed
-        while data.resolveAll():
-            pass
+        if chunkSize is None:
+            chunkSize = self.chunkSize
+
+        if multiPass:
+            # resolve all until resolveAll returns false because nothing was changed
+            while data.resolveAll():
+                pass
+        elif chunkSize:
+            data.reduceChunked(chunkSize, workers=self.workers)
+        else:
+            data.reduce()
 
         return len(data)
 
-    def SolvePartTwo(self, data=None):
+    def VariantLengths(self, data=None, seeded=True, workers=None):
         """
-        Make a series of polymers based off our test data, each one omitting one pair of letters
+        Make a series of polymers based off our data, each one omitting one pair of letters, and reduce them all
+        across a process pool
+
+        Removing a unit type can't undo reactions that already happened without it, so the variants can start from
+        the already reduced polymer and still give the same lengths, while being much shorter to react. That also
+        means the data may already have been reduced by part one, and a unit type that reacted away completely is
+        no longer in it; removing it changes nothing, so it maps to the reduced length
 
-        And run tests on those
         :param data: the Polymer instance to start with
-        :return: the shortest possible polymer chain if we removed one pair of letters
+        :param seeded: start each variant from the reduced polymer instead of the full one
+        :param workers: how many processes to use, defaults to self.workers. 1 reduces everything in this process
+        :return: dict mapping every lowercase letter to the length of the reduced polymer without that letter
         """
         if not data:
             data = self.processed
 
-        # convert our data back to a string so we can more easily manipulate it
-        inString = str(data)
+        if workers is None:
+            workers = self.workers
+
+        seed = Polymer(data)
+        if seeded:
+            seed.reduce()
 
-        # get a unique list of the letters in our string
-        condensed = list(set(inString.lower()))
+        # letters that aren't in the polymer have nothing to remove, so leave it at its reduced length
+        lengths = dict.fromkeys(string.ascii_lowercase, len(seed) if seeded else Polymer(data).reduce())
 
-        # Make a new polymer by removing one lowercase and capital letter pair from our base polymer string
-        tests = {letter: Polymer(inString.replace(letter, '').replace(letter.capitalize(), '')) for letter in condensed}
+        # get a unique list of the letters in our polymer
+        condensed = sorted(set(str(seed).lower()))
+        variants = [(bytes(seed), letter) for letter in condensed]
 
-        results = {}
+        if workers == 1:
+            lengths.update(reactVariant(variant) for variant in variants)
+            return lengths
 
-        for test in tests:
-            results[test] = self.SolvePartOne(data=tests[test])
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            lengths.update(pool.map(reactVariant, variants))
+        return lengths
 
-        print(results)
+    def SolvePartTwo(self, data=None):
+        """
+        Find the shortest polymer we can make by removing one pair of letters and reacting what's left
+
+        :param data: the Polymer instance to start with
+        :return: the shortest possible polymer chain if we removed one pair of letters
+        """
+        if not data:
+            data = self.processed
 
-        return min(results.values())
+        return min(self.VariantLengths(data=data).values())
 
 
 if __name__ == '__main__':
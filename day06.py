@@ -88,37 +88,347 @@ Your puzzle answer was 37318.
 from PIL import Image
 from PIL import ImageColor
 
-from random import randint
 import math
 
+import concurrent.futures
+from multiprocessing import shared_memory
+
+import numpy
+
 import itertools
 import collections
 
 from utils import ProblemSolver, getBarycentric
 
 
+def distanceSums(values, positions):
+    """
+    Sum of the 1D distances from each position to every value, worked out from the sorted values and their
+    prefix sums instead of position by value
+
+    :param values: array of the coordinate values along one axis
+    :param positions: array of the positions to measure from along the same axis
+    :return: int64 array, for each position the sum of abs(position - value) over all values
+    """
+    values = numpy.sort(numpy.asarray(values, dtype=numpy.int64))
+    positions = numpy.asarray(positions, dtype=numpy.int64)
+    prefix = numpy.concatenate([[0], numpy.cumsum(values)])
+
+    # how many values are at or below each position
+    below = numpy.searchsorted(values, positions, side='right')
+    above = len(values) - below
+
+    return (below * positions - prefix[below]) + ((prefix[-1] - prefix[below]) - above * positions)
+
+
+def totalDistanceGrid(xs, ys, width, height):
+    """
+    Total manhattan distance from every pixel to every coordinate. The total splits into an x part and a y part,
+    so it's one distanceSums per axis added together, without the per coordinate distances
+
+    :param xs: array of the coordinates' x values
+    :param ys: array of the coordinates' y values
+    :param width: how many columns the grid has
+    :param height: how many rows the grid has
+    :return: int32 array shaped (height, width) of each pixel's total distance
+    """
+    return (distanceSums(ys, numpy.arange(height))[:, None] +
+            distanceSums(xs, numpy.arange(width))[None, :]).astype(numpy.int32)
+
+
+def scanLabels(xs, ys, columns, rows, blockSize=1 << 22):
+    """
+    Label a rectangle of pixels a block of rows at a time, computing the distance from every pixel in the block to
+    every coordinate in one go
+
+    :param xs: int32 array of the coordinates' x values
+    :param ys: int32 array of the coordinates' y values
+    :param columns: array of the x values of the rectangle
+    :param rows: array of the y values of the rectangle
+    :param blockSize: rough cap on how many distances to hold at once
+    :return: tuple of (labels, ties, totals) arrays shaped (len(rows), len(columns)), see TimeCoordinates.labelGridScan
+    """
+    columns = numpy.asarray(columns, dtype=numpy.int32)
+    rows = numpy.asarray(rows, dtype=numpy.int32)
+    width, height = len(columns), len(rows)
+
+    labels = numpy.empty((height, width), dtype=numpy.int32)
+    ties = numpy.empty((height, width), dtype=bool)
+    totals = numpy.empty((height, width), dtype=numpy.int32)
+
+    # the x distances are the same for every row, so only work them out once, shaped (coordinates, 1, width)
+    dx = numpy.abs(columns[None, :] - xs[:, None])[:, None, :]
+
+    rowsPerBlock = max(1, blockSize // max(1, len(xs) * width))
+
+    for top in range(0, height, rowsPerBlock):
+        block = slice(top, min(top + rowsPerBlock, height))
+
+        # distances shaped (coordinates, rows, width)
+        distances = numpy.abs(rows[block][None, :] - ys[:, None])[:, :, None] + dx
+
+        closest = distances.min(axis=0)
+        blockTies = (distances == closest).sum(axis=0) > 1
+        blockLabels = distances.argmin(axis=0).astype(numpy.int32)
+        blockLabels[blockTies] = -1
+
+        labels[block] = blockLabels
+        ties[block] = blockTies
+        totals[block] = distances.sum(axis=0)
+
+    return labels, ties, totals
+
+
+def uniquelyClosest(along, across):
+    """
+    Find the coordinates that are the only closest coordinate to some point infinitely far away along one axis.
+
+    From far enough away along the axis, at an offset c across it, the distance to a coordinate is a constant plus
+    abs(c - across) - along, so the closest coordinate at each offset comes out of a 1D distance transform over the
+    offsets, carrying forward whether the closest is unique. Past the last coordinate across the axis, the closest
+    never changes, so only offsets between the first and last coordinate need checking
+
+    :param along: array of each coordinate's position along the axis, further along means closer
+    :param across: array of each coordinate's position across the axis
+    :return: set of the indices of coordinates that are uniquely closest at some offset
+    """
+    low = int(across.min())
+    size = int(across.max()) - low + 1
+
+    far = float('inf')
+    nobody = -2
+
+    def closer(a, b):
+        """
+        :return: the (distance, label) of whichever of a and b is closer, with a label of -1 if they're tied
+        """
+        if a[0] < b[0]:
+            return a
+        if b[0] < a[0]:
+            return b
+        if a[0] == far:
+            return far, nobody
+        return a[0], -1
+
+    # the closest of the coordinates sitting exactly at each offset
+    own = [(far, nobody)] * size
+    for i in range(len(along)):
+        c = int(across[i]) - low
+        own[c] = closer(own[c], (-int(along[i]), i))
+
+    # the closest of the coordinates at or before each offset, and at or after it
+    before = list(own)
+    after = list(own)
+    for c in range(1, size):
+        before[c] = closer(before[c], (before[c - 1][0] + 1, before[c - 1][1]))
+    for c in range(size - 2, -1, -1):
+        after[c] = closer(after[c], (after[c + 1][0] + 1, after[c + 1][1]))
+
+    winners = set()
+    for c in range(size):
+        closest = before[c]
+        if c + 1 < size:
+            closest = closer(closest, (after[c + 1][0] + 1, after[c + 1][1]))
+
+        if closest[1] >= 0:
+            winners.add(closest[1])
+
+    return winners
+
+
+def labelTile(task):
+    """
+    Label one tile of the grid straight into a shared memory grid, so only the tile's areas have to come back
+    from the worker rather than its labels
+
+    :param task: tuple of the shared memory name, the grid's shape, the coordinates' xs and ys and the tile's
+        (left, top, right, bottom)
+    :return: array of how many pixels in the tile are closest to each coordinate
+    """
+    name, shape, xs, ys, (left, top, right, bottom) = task
+
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        grid = numpy.ndarray(shape, dtype=numpy.int32, buffer=memory.buf)
+        labels, ties, totals = scanLabels(xs, ys, numpy.arange(left, right), numpy.arange(top, bottom))
+        grid[top:bottom, left:right] = labels
+        del grid
+    finally:
+        memory.close()
+
+    return numpy.bincount(labels[~ties], minlength=len(xs))
+
+
+def regionColor(index):
+    """
+    Multiplying by an odd number is a one to one mapping of 24 bit numbers, so this spreads the indices out over
+    the colors without two regions ever getting the same one, unlike picking them at random
+
+    :param index: index of the region
+    :return: (r, g, b) color for that region, never black (used for ties) below 2 ** 24 - 1 regions
+    """
+    value = ((index + 1) * 0x9E3779) & 0xFFFFFF
+    return (value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF
+
+
 class TimeCoordinates(object):
     """
     Data for day6, a list of input coordinates mapped to random colors, and an image
     that can fit all the input points
     """
-    def __init__(self, image, coordinates, regionDistance):
-        self.coordinates = {coord: (randint(1, 255), randint(1, 255), randint(1, 255)) for coord in coordinates}
-        self.image = image
-        self.pointsInRegion = 0
+
+    # past this many coordinates, growing the regions outwards beats measuring every pixel against every coordinate
+    growThreshold = 32
+
+    def __init__(self, size, coordinates, regionDistance, image=None):
+        """
+        :param size: (width, height) of the grid that fits all the coordinates
+        :param coordinates: iterable of (x, y) tuples
+        :param regionDistance: the total distance to all the coordinates a point has to be under to be in the
+            safe region
+        :param image: PIL image to draw into, if None, one is only made if something asks for it
+        """
+        self.size = size
+        self._image = image
+
+        # set tileSize to label the grid in square tiles of that many pixels across a process pool
+        self.tileSize = None
+        self.workers = None
+
+        # results worked out from the coordinates, computed the first time they're asked for
+        self._cache = {}
+
+        self.coordinates = coordinates
         self.regionDistance = regionDistance
 
-        for coord in self.coordinates:
+    @property
+    def image(self):
+        """
+        Solving only needs the label arrays, so the image is made the first time something draws into it
+
+        :return: PIL image the size of our grid, with each coordinate drawn in its color
+        """
+        if self._image is None:
+            self._image = Image.new('RGB', self.size)
+            self.drawCoordinates()
+
+        return self._image
+
+    def drawCoordinates(self):
+        """
+        Draw each coordinate into the image in its color
+        """
+        for coord in self._coordinates:
             #print('initializing coord', coord, 'to ', self.coordinates[coord])
-            self.image.putpixel(coord, self.coordinates[coord])
+            self._image.putpixel(coord, self._coordinates[coord])
+
+    @property
+    def coordinates(self):
+        """
+        :return: dict mapping each (x, y) coordinate to its color
+        """
+        return self._coordinates
+
+    @coordinates.setter
+    def coordinates(self, coordinates):
+        """
+        Assign each of the coordinates a color, and throw out anything we worked out from the old ones.
+        If any of the new coordinates are outside the grid, the grid grows to fit them
+        :param coordinates: iterable of (x, y) tuples
+        """
+        newCoordinates = {}
+        for coord in coordinates:
+            if coord[0] < 0 or coord[1] < 0:
+                raise ValueError("Coordinate {} is outside the grid".format(coord))
+
+            if coord not in newCoordinates:
+                newCoordinates[coord] = regionColor(len(newCoordinates))
+
+        width = max([self.size[0]] + [coord[0] + 1 for coord in newCoordinates])
+        height = max([self.size[1]] + [coord[1] + 1 for coord in newCoordinates])
+        if (width, height) != tuple(self.size):
+            self.size = (width, height)
+
+            # the old image is the wrong size now, it gets remade if anything asks for it
+            self._image = None
+
+        self._coordinates = newCoordinates
+        self._cache.clear()
+
+        if self._image is not None:
+            self.drawCoordinates()
+
+    @property
+    def regionDistance(self):
+        """
+        :return: the total distance to all the coordinates a point has to be under to be in the safe region
+        """
+        return self._regionDistance
+
+    @regionDistance.setter
+    def regionDistance(self, regionDistance):
+        self._regionDistance = regionDistance
+
+        # only the safe region depends on the distance
+        self._cache.pop('pointsInRegion', None)
+
+    @property
+    def grids(self):
+        """
+        :return: the (labels, ties, totals) arrays from labelGrid, computed once
+        """
+        if 'grids' not in self._cache:
+            if self.tileSize:
+                self._cache['grids'], self._cache['areas'] = self.labelGridTiled()
+            else:
+                self._cache['grids'] = self.labelGrid()
+
+        return self._cache['grids']
+
+    @property
+    def areas(self):
+        """
+        :return: array of how many pixels are closest to each coordinate, in the same order as self.coordinates
+        """
+        labels, ties, totals = self.grids
+
+        if 'areas' not in self._cache:
+            self._cache['areas'] = numpy.bincount(labels[~ties], minlength=len(self.coordinates))
+
+        return self._cache['areas']
+
+    @property
+    def infiniteRegions(self):
+        """
+        A region is infinite if its coordinate is the only closest one to some point infinitely far away, which
+        only has to be checked looking in from each of the four directions, so this doesn't need the grid at all
+
+        :return: set of the indices into self.coordinates of the regions that are infinite
+        """
+        if 'infiniteRegions' not in self._cache:
+            xs, ys = self.coordinateArrays()
+            self._cache['infiniteRegions'] = (uniquelyClosest(xs, ys) | uniquelyClosest(-xs, ys) |
+                                              uniquelyClosest(ys, xs) | uniquelyClosest(-ys, xs))
+
+        return self._cache['infiniteRegions']
+
+    @property
+    def pointsInRegion(self):
+        """
+        :return: the number of points in the safe region, computed once
+        """
+        if 'pointsInRegion' not in self._cache:
+            self._cache['pointsInRegion'] = self.safeRegionSize()
+
+        return self._cache['pointsInRegion']
 
     def voroni(self):
         """
         Assigns a unique color to each coordinate, and determines which coordinates in the map are manhattan-close
         to which point, then
-        :return:
+        :return: the number of pixels in the image whose total distance is within the region distance
         """
-        self.pointsInRegion = 0
+        pointsInRegion = 0
 
         for x in range(self.image.width):
             for y in range(self.image.height):
@@ -133,7 +443,7 @@ class TimeCoordinates(object):
 
                 # if the distance is within our region distance, increment this value
                 if totalDistance < self.regionDistance:
-                    self.pointsInRegion += 1
+                    pointsInRegion += 1
 
                 # skip the distance checking if we're already a coordinate
                 if (x, y) in self.coordinates:
@@ -145,6 +455,170 @@ class TimeCoordinates(object):
                     closestCoord = inverted[minV]
                     self.image.putpixel((x, y), self.coordinates[closestCoord])
 
+        return pointsInRegion
+
+    def render(self):
+        """
+        Draw the labelled grid as an image, with each region in its coordinate's color and ties in black. This is
+        done with one lookup into a color table and one buffer conversion rather than a call per pixel
+
+        :return: PIL RGB image of the regions
+        """
+        labels, ties, totals = self.grids
+
+        palette = numpy.zeros((len(self.coordinates) + 1, 3), dtype=numpy.uint8)
+        palette[1:] = list(self.coordinates.values())
+
+        return Image.fromarray(palette[labels + 1], 'RGB')
+
+    def coordinateArrays(self):
+        """
+        :return: int32 arrays of the x and y values of our coordinates, in the same order as self.coordinates
+        """
+        xs = numpy.array([coord[0] for coord in self.coordinates], dtype=numpy.int32)
+        ys = numpy.array([coord[1] for coord in self.coordinates], dtype=numpy.int32)
+        return xs, ys
+
+    def labelGrid(self):
+        """
+        Label every pixel with its closest coordinate, picking whichever labelling method is cheaper for the
+        number of coordinates we have
+
+        :return: tuple of (labels, ties, totals) arrays, see labelGridScan
+        """
+        if len(self.coordinates) > self.growThreshold:
+            return self.labelGridGrow()
+
+        return self.labelGridScan()
+
+    def labelGridScan(self, blockSize=1 << 22):
+        """
+        Vectorized version of voroni. Works through the image a block of rows at a time, computing the distance
+        from every pixel in the block to every coordinate in one go, so we only ever hold about blockSize
+        distances in memory
+
+        :param blockSize: rough cap on how many distances to hold at once
+        :return: tuple of arrays shaped (height, width):
+            labels, int32 index into self.coordinates of each pixel's closest coordinate, -1 where there's a tie
+            ties, bool mask of the pixels that are equally close to two or more coordinates
+            totals, int32 sum of the distances from each pixel to every coordinate
+        """
+        width, height = self.size
+        xs, ys = self.coordinateArrays()
+
+        return scanLabels(xs, ys, numpy.arange(width), numpy.arange(height), blockSize=blockSize)
+
+    def labelGridTiled(self):
+        """
+        Label the grid by splitting it into square tiles of self.tileSize pixels and labelling the tiles across a
+        process pool. The tiles write their labels straight into one grid in shared memory, so only the
+        coordinates and each tile's area counts get passed between processes
+
+        :return: tuple of the (labels, ties, totals) arrays, see labelGridScan, and the array of areas summed up
+            from all the tiles
+        """
+        width, height = self.size
+        xs, ys = self.coordinateArrays()
+        shape = (height, width)
+
+        memory = shared_memory.SharedMemory(create=True, size=max(1, width * height * 4))
+        try:
+            tasks = [(memory.name, shape, xs, ys,
+                      (left, top, min(left + self.tileSize, width), min(top + self.tileSize, height)))
+                     for top in range(0, height, self.tileSize) for left in range(0, width, self.tileSize)]
+
+            areas = numpy.zeros(len(xs), dtype=numpy.int64)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as pool:
+                for tileAreas in pool.map(labelTile, tasks):
+                    areas += tileAreas
+
+            labels = numpy.ndarray(shape, dtype=numpy.int32, buffer=memory.buf).copy()
+        finally:
+            memory.close()
+            memory.unlink()
+
+        ties = labels == -1
+
+        totals = totalDistanceGrid(xs, ys, width, height)
+
+        return (labels, ties, totals), areas
+
+    def labelGridGrow(self):
+        """
+        Label every pixel by growing all the coordinates outwards at once, one manhattan distance step at a time,
+        like a breadth first search started from every coordinate. Each pixel is reached once, so the cost
+        depends on the size of the image and not on how many coordinates there are.
+
+        The pixels reached at distance d are closest to exactly the coordinates that their neighbours at
+        distance d - 1 were closest to, so a pixel is tied if those neighbours disagree or are tied themselves
+
+        :return: tuple of (labels, ties, totals) arrays, see labelGridScan
+        """
+        width, height = self.size
+        xs, ys = self.coordinateArrays()
+
+        unvisited = -2
+        flatLabels = numpy.full(width * height, unvisited, dtype=numpy.int32)
+
+        # seed the grid with each coordinate's own label
+        frontier = ys.astype(numpy.int64) * width + xs
+        flatLabels[frontier] = numpy.arange(len(xs), dtype=numpy.int32)
+
+        while frontier.size:
+            frontierX = frontier % width
+            frontierY = frontier // width
+            frontierLabels = flatLabels[frontier]
+
+            # step out from the frontier in each direction, staying inside the image
+            steps = [(frontierX > 0, -1), (frontierX < width - 1, 1), (frontierY > 0, -width), (frontierY < height - 1, width)]
+            neighbours = numpy.concatenate([frontier[inside] + offset for inside, offset in steps])
+            neighbourLabels = numpy.concatenate([frontierLabels[inside] for inside, offset in steps])
+
+            isNew = flatLabels[neighbours] == unvisited
+            neighbours = neighbours[isNew]
+            neighbourLabels = neighbourLabels[isNew]
+
+            # group up everything that reached the same pixel
+            order = numpy.argsort(neighbours, kind='stable')
+            neighbours = neighbours[order]
+            neighbourLabels = neighbourLabels[order]
+            frontier, starts = numpy.unique(neighbours, return_index=True)
+
+            if not frontier.size:
+                break
+
+            lowest = numpy.minimum.reduceat(neighbourLabels, starts)
+            highest = numpy.maximum.reduceat(neighbourLabels, starts)
+            flatLabels[frontier] = numpy.where(lowest == highest, lowest, -1)
+
+        labels = flatLabels.reshape((height, width))
+        ties = labels == -1
+
+        totals = totalDistanceGrid(xs, ys, width, height)
+
+        return labels, ties, totals
+
+    def safeRegionSize(self):
+        """
+        Count the points whose total distance to every coordinate is less than our region distance.
+
+        The manhattan distance sum splits into a sum of x distances plus a sum of y distances, so work those
+        out for every column and row on their own, then count the (column, row) pairs whose sums add up to less
+        than the region distance. A point further than regionDistance / len(coordinates) outside the bounding box
+        of the coordinates is at least that far from every one of them, so it can't be in the region, and searching
+        out to there catches any of the region that's outside the image
+
+        :return: the number of points in the safe region
+        """
+        xs, ys = self.coordinateArrays()
+        margin = self.regionDistance // max(1, len(xs)) + 1
+
+        columnSums = distanceSums(xs, numpy.arange(xs.min() - margin, xs.max() + margin + 1))
+        rowSums = numpy.sort(distanceSums(ys, numpy.arange(ys.min() - margin, ys.max() + margin + 1)))
+
+        # for each column, how many rows keep the total under the region distance
+        return int(numpy.searchsorted(rowSums, self.regionDistance - columnSums, side='left').sum())
+
 
 class Day06Solver(ProblemSolver):
     """
@@ -156,12 +630,16 @@ class Day06Solver(ProblemSolver):
         self.testDataPartOne = {'1, 1\n1, 6\n8, 3\n3, 4\n5, 5\n8, 9': 17}
         self.testDataPartTwo = {'1, 1\n1, 6\n8, 3\n3, 4\n5, 5\n8, 9': 16}
 
+        # set tileSize to count areas in square tiles of that many pixels across a pool of processes
+        self.tileSize = None
+        self.workers = None
+
     def ProcessInput(self, data=None):
         """
         Grab the coordinate data from our input string
 
         :param data:
-        :return: a time coordinates object with an image and the used coordinate for voronication
+        :return: a time coordinates object with the grid size and the used coordinate for voronication
         """
         if not data:
             data = self.rawData
@@ -181,14 +659,14 @@ class Day06Solver(ProblemSolver):
 
         print(xSize, ySize)
 
-        image = Image.new('RGB', (xSize, ySize))
-
         # detect if we're parsing test data or our own
         regionDistance = 32
         if len(points) > 10:
             regionDistance = 10000
 
-        processed = TimeCoordinates(image, points, regionDistance)
+        processed = TimeCoordinates((xSize, ySize), points, regionDistance)
+        processed.tileSize = self.tileSize
+        processed.workers = self.workers
 
         return processed
 
@@ -252,41 +730,19 @@ class Day06Solver(ProblemSolver):
         if not data:
             data = self.processed
 
-        data.voroni()
-
-        areas = collections.defaultdict(int)
-
-        infiniteColors = collections.defaultdict(int)
-
-        for x in range(data.image.width):
-            for y in range(data.image.height):
-                point = (x, y)
-
-                color = data.image.getpixel(point)
+        areas = [data.areas[i] for i in range(len(data.coordinates)) if i not in data.infiniteRegions]
 
-                # if any of the regions are on the border of the image, their fields extend into infinity
-                # so we can automatically discount them in later processing
-                if x == 0 or x == data.image.width - 1 or y == 0 or y == data.image.height - 1:
-                    infiniteColors[color] += 1
-
-                areas[color] += 1
-
-        finiteAreas = [areas[color] for color in areas if color not in infiniteColors]
-
-        return max(finiteAreas)
+        return int(max(areas))
 
     def SolvePartTwo(self, data=None):
         """
         Find the region that is within a certain distance of all the points in the system
-        Since we get this information basically for free during the voroni calculation
 
         :return: the number of points within our safe region distance
         """
         if not data:
             data = self.processed
 
-        data.voroni()
-
         return data.pointsInRegion
 
 
@@ -40,8 +40,18 @@ In what order should the steps in your instructions be completed?
 
 from utils import ProblemSolver
 
+import array
 import collections
+import concurrent.futures
+import heapq
+import os
+import re
 import string
+from time import perf_counter
+
+
+# steps can be named anything without spaces, not just single letters
+StepPattern = re.compile(r'Step (\S+) must be finished before step (\S+) can begin')
 
 
 class Step(object):
@@ -81,19 +91,15 @@ class Elf(object):
         self.task = ''
         self.timer = 0
 
-    def update(self):
+    def release(self):
         """
-        decrement the timer, and if our timer is 0, blank our task
-        :return:
+        finish our current task and blank it, so we're available again
+        :return: the id of the task we finished
         """
-        self.timer -= 1
-        self.timer = max(0, self.timer)
-        if self.timer == 0 and self.task:
-            task = self.task
-            self.task = ''
-            return task
-
-        return None
+        task = self.task
+        self.task = ''
+        self.timer = 0
+        return task
 
     def isAvailable(self):
         """
@@ -118,37 +124,427 @@ class Elf(object):
         self.timer = timer
 
 
-def allFinished(instructions):
+class CycleError(Exception):
     """
-    Determine if any of the steps in our instruciton list are uncompleted.
-    :param instructions:
-    :return: if all instructions are completed
+    Raised when the steps can't all be ordered because some of them depend on each other in a loop
     """
-    for i in instructions:
-        if not instructions[i].completed:
-            return False
+    def __init__(self, cycle):
+        """
+        :param cycle: list of the step names in the loop, in order
+        """
+        self.cycle = cycle
+        super(CycleError, self).__init__("Steps form a cycle: {}".format(' > '.join(cycle + cycle[:1])))
+
+
+class StepGraph(object):
+    """
+    Compact version of the step instructions for big graphs. Steps can be named anything, and are numbered in the
+    order they're first seen, with the successors of every step packed into one flat array, so the graph costs a
+    few ints per step and per edge rather than a Step object and lists for every step
+    """
+    def __init__(self, names, edges):
+        """
+        :param names: list of the step names, a step's index in this list is its number
+        :param edges: iterable of (before, after) step number pairs, where before must finish before after can begin
+        """
+        self.names = names
+
+        # successors of step i are successors[successorStart[i]:successorStart[i + 1]]
+        befores = array.array('i')
+        afters = array.array('i')
+        for before, after in edges:
+            befores.append(before)
+            afters.append(after)
+
+        stepCount = len(names)
+        self.predecessorCount = array.array('i', [0]) * stepCount
+        self.successorStart = array.array('i', [0]) * (stepCount + 1)
+        for before, after in zip(befores, afters):
+            self.successorStart[before + 1] += 1
+            self.predecessorCount[after] += 1
+
+        for i in range(stepCount):
+            self.successorStart[i + 1] += self.successorStart[i]
+
+        self.successors = array.array('i', [0]) * len(befores)
+        filled = self.successorStart[:-1]
+        for before, after in zip(befores, afters):
+            self.successors[filled[before]] = after
+            filled[before] += 1
+
+    @classmethod
+    def fromEdges(cls, namedEdges):
+        """
+        :param namedEdges: iterable of (before, after) step name pairs
+        :return: a StepGraph of those steps
+        """
+        index = {}
+        names = []
+
+        def number(name):
+            if name not in index:
+                index[name] = len(names)
+                names.append(name)
+            return index[name]
+
+        edges = [(number(before), number(after)) for before, after in namedEdges]
+
+        return cls(names, edges)
+
+    @classmethod
+    def fromInstructions(cls, instructions):
+        """
+        :param instructions: dict of step name to Step
+        :return: a StepGraph of the same steps
+        """
+        names = list(instructions)
+        index = {name: i for i, name in enumerate(names)}
+
+        return cls(names, ((index[name], index[successor]) for name in names
+                           for successor in instructions[name].successors))
+
+    @classmethod
+    def fromText(cls, data):
+        """
+        Parse the instructions straight into a StepGraph, without making a Step for every step
+
+        :param data: instruction lines like 'Step C must be finished before step A can begin.'
+        :return: a StepGraph of the steps in the instructions
+        """
+        return cls.fromEdges(StepPattern.findall(data))
+
+    def edges(self):
+        """
+        :return: generator of every (before, after) step number pair
+        """
+        for before in range(len(self.names)):
+            for after in self.successors[self.successorStart[before]:self.successorStart[before + 1]]:
+                yield before, after
+
+    def topologicalNumbers(self):
+        """
+        :return: list of the step numbers in some order where every step comes after its predecessors, found in
+            linear time since it doesn't care which available step goes first
+        """
+        waitingOn = array.array('i', self.predecessorCount)
+        order = [i for i in range(len(self.names)) if not waitingOn[i]]
+
+        # order doubles as the queue, since steps are only ever added to the end of it
+        for step in order:
+            for successor in self.successors[self.successorStart[step]:self.successorStart[step + 1]]:
+                waitingOn[successor] -= 1
+                if not waitingOn[successor]:
+                    order.append(successor)
+
+        if len(order) < len(self.names):
+            raise CycleError(self.findCycle(order))
+
+        return order
+
+    def analyse(self, durations):
+        """
+        Work out the critical path through the steps, and how early and late each step can start without making
+        everything take longer than it has to with as many Elves as we want
+
+        :param durations: function that takes a step name and returns how long it takes, or a dict of them
+        :return: a PathAnalysis of the graph
+        """
+        if not callable(durations):
+            durations = durations.__getitem__
+
+        times = [durations(name) for name in self.names]
+        order = self.topologicalNumbers()
+
+        # a step can start as soon as the last of its predecessors is done
+        earliestStart = [0] * len(self.names)
+        for step in order:
+            finish = earliestStart[step] + times[step]
+            for successor in self.successors[self.successorStart[step]:self.successorStart[step + 1]]:
+                if finish > earliestStart[successor]:
+                    earliestStart[successor] = finish
+
+        length = max([earliestStart[i] + times[i] for i in range(len(self.names))] or [0])
+
+        # and has to start early enough to finish before the first of its successors has to start
+        latestStart = [0] * len(self.names)
+        for step in reversed(order):
+            latestFinish = length
+            for successor in self.successors[self.successorStart[step]:self.successorStart[step + 1]]:
+                latestFinish = min(latestFinish, latestStart[successor])
+            latestStart[step] = latestFinish - times[step]
+
+        # follow the steps with no slack from the start to the end
+        criticalPath = []
+        step = next((i for i in order if earliestStart[i] == 0 and latestStart[i] == 0), None)
+        while step is not None:
+            criticalPath.append(self.names[step])
+            finish = earliestStart[step] + times[step]
+            step = next((successor for successor in
+                         self.successors[self.successorStart[step]:self.successorStart[step + 1]]
+                         if earliestStart[successor] == latestStart[successor] == finish), None)
+
+        return PathAnalysis(self.names, times, earliestStart, latestStart, length, criticalPath)
+
+    def execute(self, jobs, workerPoolSize=None, pool=None, priority=None):
+        """
+        Actually run a job for every step on a concurrent.futures pool, handing each step to the pool as soon as
+        all its predecessors have finished, and picking the available step with the best priority whenever
+        there's a choice
+
+        :param jobs: dict of step name to the callable to run for that step, which takes no arguments. Has to be
+            picklable if the pool is a ProcessPoolExecutor
+        :param workerPoolSize: most steps to have running at once, defaults to however many workers the pool has,
+            so a step never waits in the pool's own queue where the priority can't reach it
+        :param pool: concurrent.futures Executor to run the jobs on, defaults to a ThreadPoolExecutor of
+            workerPoolSize threads, or one per CPU, that's shut down afterwards
+        :param priority: sort key function on step names, see priorityRanks
+        :return: tuple of a dict of step name to what its job returned, and a dict of step name to how many
+            seconds its job took
+        """
+        if workerPoolSize is not None and workerPoolSize < 1:
+            raise ValueError("Need room for at least one running step, got {}".format(workerPoolSize))
+
+        # find any cycle before anything gets run
+        self.topologicalNumbers()
+
+        ranks, byRank = self.priorityRanks(priority)
+        waitingOn = array.array('i', self.predecessorCount)
+
+        available = [ranks[i] for i in range(len(self.names)) if not waitingOn[i]]
+        heapq.heapify(available)
+
+        ownPool = pool is None
+        if ownPool:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=workerPoolSize or os.cpu_count() or 1)
+        if workerPoolSize is None:
+            workerPoolSize = getattr(pool, '_max_workers', None) or os.cpu_count() or 1
+
+        results = {}
+        wallTimes = {}
+        running = {}
+
+        try:
+            while available or running:
+                # hand out as many available steps as we have room for
+                while available and len(running) < workerPoolSize:
+                    step = byRank[heapq.heappop(available)]
+                    running[pool.submit(timedCall, jobs[self.names[step]])] = step
+
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                # finish them in step order, so the same steps become available in the same order every time
+                for future in sorted(done, key=lambda f: ranks[running[f]]):
+                    step = running.pop(future)
+                    results[self.names[step]], wallTimes[self.names[step]] = future.result()
+
+                    for successor in self.successors[self.successorStart[step]:self.successorStart[step + 1]]:
+                        waitingOn[successor] -= 1
+                        if not waitingOn[successor]:
+                            heapq.heappush(available, ranks[successor])
+        finally:
+            if ownPool:
+                pool.shutdown(wait=True)
+
+        return results, wallTimes
+
+    def priorityRanks(self, priority=None):
+        """
+        :param priority: function that takes a step name and returns a sort key, steps with smaller keys get
+            picked first when there's a choice. Defaults to alphabetical by name
+        :return: tuple of an array of each step's rank, and the list of step numbers in rank order
+        """
+        byRank = sorted(range(len(self.names)), key=lambda i: (priority or str)(self.names[i]))
+
+        ranks = array.array('i', [0]) * len(self.names)
+        for rank, i in enumerate(byRank):
+            ranks[i] = rank
+
+        return ranks, byRank
+
+    def findCycle(self, finished):
+        """
+        Walk backwards through the predecessors of steps that never got finished until we come back around to a
+        step we've already seen. Every unfinished step has an unfinished predecessor, so this always finds one
+
+        :param finished: list of the step numbers that did finish
+        :return: list of the step names in the cycle, in the order they have to happen
+        """
+        remaining = set(range(len(self.names))) - set(finished)
+
+        predecessors = collections.defaultdict(list)
+        for before, after in self.edges():
+            if before in remaining and after in remaining:
+                predecessors[after].append(before)
+
+        seen = {}
+        path = []
+        step = min(remaining)
+
+        while step not in seen:
+            seen[step] = len(path)
+            path.append(step)
+            step = min(predecessors[step])
+
+        return [self.names[i] for i in reversed(path[seen[step]:])]
+
+    def order(self, priority=None):
+        """
+        Order the steps so every step comes after its predecessors, picking the step with the best priority
+        whenever there's a choice.
+
+        Instead of checking every step's predecessors each time, this counts how many unfinished predecessors each
+        step has, and keeps the steps that have none left in a heap, so finishing a step only touches its successors
+
+        :param priority: sort key function on step names, see priorityRanks
+        :return: list of the step names in the order they should be completed
+        """
+        ranks, byRank = self.priorityRanks(priority)
+        waitingOn = array.array('i', self.predecessorCount)
+
+        available = [ranks[i] for i in range(len(self.names)) if not waitingOn[i]]
+        heapq.heapify(available)
+
+        order = []
+        while available:
+            step = byRank[heapq.heappop(available)]
+            order.append(step)
+
+            for successor in self.successors[self.successorStart[step]:self.successorStart[step + 1]]:
+                waitingOn[successor] -= 1
+                if not waitingOn[successor]:
+                    heapq.heappush(available, ranks[successor])
 
-    return True
+        if len(order) < len(self.names):
+            raise CycleError(self.findCycle(order))
 
+        return [self.names[i] for i in order]
 
-def firstAvailable(instructions):
+    def schedule(self, workerPoolSize, durations, priority=None):
+        """
+        Simulate a pool of Elves working through the steps, where each free Elf picks up the available step with
+        the best priority.
+
+        Nothing changes between one Elf finishing and the next, so rather than ticking the clock a second at a time
+        this keeps a heap of when each busy Elf finishes and jumps straight to the next one
+
+        :param workerPoolSize: how many Elves are working
+        :param durations: function that takes a step name and returns how long it takes, or a dict of them
+        :param priority: sort key function on step names, see priorityRanks
+        :return: tuple of the time the last step finished and the list of step names in the order they finished
+        """
+        if workerPoolSize < 1:
+            raise ValueError("Need at least one Elf to work on the steps, got {}".format(workerPoolSize))
+
+        if not callable(durations):
+            durations = durations.__getitem__
+
+        ranks, byRank = self.priorityRanks(priority)
+        waitingOn = array.array('i', self.predecessorCount)
+
+        available = [ranks[i] for i in range(len(self.names)) if not waitingOn[i]]
+        heapq.heapify(available)
+
+        workerPool = [Elf(i) for i in range(workerPoolSize)]
+        freeWorkers = list(range(workerPoolSize))
+
+        # (finish time, worker index, step number) for every busy Elf
+        finishing = []
+
+        completedOrder = []
+        time = 0
+
+        while available or finishing:
+            # hand out as many available steps as we have free Elves for
+            while available and freeWorkers:
+                step = byRank[heapq.heappop(available)]
+                worker = heapq.heappop(freeWorkers)
+                taskTime = durations(self.names[step])
+
+                workerPool[worker].assignTask(self.names[step], taskTime)
+                heapq.heappush(finishing, (time + taskTime, worker, step))
+
+            if not finishing:
+                break
+
+            # jump ahead to the next Elf finishing, and finish everything else that's done at the same time
+            time = finishing[0][0]
+            while finishing and finishing[0][0] == time:
+                _, worker, step = heapq.heappop(finishing)
+
+                workerPool[worker].release()
+                heapq.heappush(freeWorkers, worker)
+
+                completedOrder.append(step)
+
+                for successor in self.successors[self.successorStart[step]:self.successorStart[step + 1]]:
+                    waitingOn[successor] -= 1
+                    if not waitingOn[successor]:
+                        heapq.heappush(available, ranks[successor])
+
+        if len(completedOrder) < len(self.names):
+            raise CycleError(self.findCycle(completedOrder))
+
+        return time, [self.names[i] for i in completedOrder]
+
+
+def timedCall(job):
     """
-    Sort our instructions alphabetically, then test if their predecessors are all completed
-    and return that key
+    Run a job and time it in the worker that runs it, so the time doesn't include waiting in the pool's queue
 
-    :param instructions:
-    :return:
+    :param job: callable that takes no arguments
+    :return: tuple of what the job returned and how many seconds it took
+    """
+    start = perf_counter()
+    result = job()
+    return result, perf_counter() - start
+
+
+class PathAnalysis(object):
+    """
+    Critical path analysis of a StepGraph, see StepGraph.analyse
     """
-    for i in sorted(instructions.keys()):
-        if not instructions[i].completed and not instructions[i].inProgress:
-            # deteremine our predecessors
-            predecessors = {p: instructions[p] for p in instructions[i].predecessors}
+    def __init__(self, names, times, earliestStart, latestStart, length, criticalPath):
+        """
+        :param names: list of the step names, indexed by step number
+        :param times: list of how long each step takes
+        :param earliestStart: list of the earliest time each step can start
+        :param latestStart: list of the latest time each step can start without holding everything up
+        :param length: how long the critical path takes, the soonest everything can finish
+        :param criticalPath: list of the step names on the critical path, in order
+        """
+        self.names = names
+        self.times = times
+        self.earliestStart = earliestStart
+        self.latestStart = latestStart
+        self.length = length
+        self.criticalPath = criticalPath
+        self.totalWork = sum(times)
+
+    def slack(self):
+        """
+        :return: dict of step name to how long that step can be put off without holding everything up
+        """
+        return {name: late - early for name, early, late in zip(self.names, self.earliestStart, self.latestStart)}
 
-            # if they're all finished, return it
-            if allFinished(predecessors):
-                return i
+    def lowerBound(self, workerPoolSize):
+        """
+        No schedule can beat the critical path, or the total work shared perfectly between the Elves
+
+        :param workerPoolSize: how many Elves are working
+        :return: the soonest that many Elves could possibly finish every step
+        """
+        return max(self.length, -(-self.totalWork // workerPoolSize))
 
-    return None
+
+def topologicalOrder(instructions):
+    """
+    Order the steps so every step comes after its predecessors, picking the first available step alphabetically
+    whenever there's a choice
+
+    :param instructions: dict of step name to Step
+    :return: list of the step names in the order they should be completed
+    """
+    return StepGraph.fromInstructions(instructions).order()
 
 
 class Day07Solver(ProblemSolver):
@@ -159,6 +555,12 @@ class Day07Solver(ProblemSolver):
     def __init__(self):
         super(Day07Solver, self).__init__(7)
 
+        # override how many Elves work, how long each step takes (dict of step name to time), and which available
+        # step gets picked first (sort key function on step names) in part two, None uses the puzzle's rules
+        self.workers = None
+        self.durations = None
+        self.priority = None
+
         self.testDataPartOne = {'Step C must be finished before step A can begin.\nStep C must be finished before step F can begin.\nStep A must be finished before step B can begin.\nStep A must be finished before step D can begin.\nStep B must be finished before step E can begin.\nStep D must be finished before step E can begin.\nStep F must be finished before step E can begin.': 'CABDFE'}
         self.testDataPartTwo = {'Step C must be finished before step A can begin.\nStep C must be finished before step F can begin.\nStep A must be finished before step B can begin.\nStep A must be finished before step D can begin.\nStep B must be finished before step E can begin.\nStep D must be finished before step E can begin.\nStep F must be finished before step E can begin.': 15}
 
@@ -171,11 +573,7 @@ class Day07Solver(ProblemSolver):
 
         processed = collections.defaultdict(Step)
 
-        for line in data.split('\n'):
-            tokens = line.split(' ')
-            step = tokens[1]
-            successor = tokens[-3]
-
+        for step, successor in StepPattern.findall(data):
             processed[step].successors.append(successor)
             processed[successor].predecessors.append(step)
 
@@ -187,30 +585,21 @@ class Day07Solver(ProblemSolver):
 
     def SolvePartOne(self, data=None):
         """
+        Find the order the steps should be completed in
 
         :param data:
-        :return:
+        :return: the step names joined up in order
         """
         if not data:
             data = self.processed
 
-        completedOrder = []
-
-        while not allFinished(data):
-            first = firstAvailable(data)
-            if first:
-                completedOrder.append(first)
-                data[first].completed = True
-            else:
-                raise Exception("something has gone wrong and nothing is available")
+        return ''.join(topologicalOrder(data))
 
-        return ''.join(completedOrder)
-
-    def SolvePartTwo(self, data=None):
+    def WorkerRules(self, data):
         """
-
-        :param data:
-        :return:
+        :param data: dict of step name to Step
+        :return: tuple of how many Elves are working and the function that says how long each step takes,
+            following the puzzle's rules unless they've been overridden
         """
         def getTaskTime(task):
             """
@@ -220,25 +609,6 @@ class Day07Solver(ProblemSolver):
             """
             return string.ascii_uppercase.index(task) + taskFactor + 1
 
-        def firstAvailableWorker(workers):
-            """
-            # TODO this would be cooler if our worker pool was an object too
-            :param workers: our workerpool
-            :return: None, or the first available worker
-            """
-            for i, worker in enumerate(workers):
-                if worker.isAvailable():
-                    return i
-
-            return -1
-
-        if not data:
-            data = self.processed
-            for key in data:
-                data[key].completed = False
-
-        completedOrder = []
-
         taskFactor = 0
         workerPoolSize = 2
 
@@ -247,43 +617,43 @@ class Day07Solver(ProblemSolver):
             taskFactor = 60
             workerPoolSize = 5
 
-        workerPool = [Elf(i) for i in range(workerPoolSize)]
+        if self.workers:
+            workerPoolSize = self.workers
 
-        time = 0
+        return workerPoolSize, self.durations or getTaskTime
 
-        while not allFinished(data):
-
-            # if we have any available workers
-            while firstAvailableWorker(workerPool) > -1:
-                newTask = firstAvailable(data)
+    def AnalyseSteps(self, data=None):
+        """
+        Find the critical path and the best possible finishing time without simulating the Elves
 
-                # if nothing is available, break out of this loop
-                if not newTask:
-                    break
+        :param data:
+        :return: tuple of the PathAnalysis of the steps, and the lower bound on the time for our pool of Elves
+        """
+        if not data:
+            data = self.processed
 
-                taskTime = getTaskTime(newTask)
-                workerPool[firstAvailableWorker(workerPool)].assignTask(newTask, taskTime)
-                data[newTask].inProgress = True
+        workerPoolSize, durations = self.WorkerRules(data)
+        analysis = StepGraph.fromInstructions(data).analyse(durations)
 
-            debugString = str(time)
+        return analysis, analysis.lowerBound(workerPoolSize)
 
-            for worker in workerPool:
-                debugString += ' {}'.format(worker.task or '.')
+    def SolvePartTwo(self, data=None):
+        """
+        Work out how long it takes a pool of Elves to finish every step
 
-            print(debugString)
+        :param data:
+        :return: the time the last step is finished
+        """
+        if not data:
+            data = self.processed
 
-            # update all our workers
-            for worker in workerPool:
-                completedTask = worker.update()
-                if completedTask:
-                    completedOrder.append(completedTask)
-                    data[completedTask].completed = True
+        workerPoolSize, durations = self.WorkerRules(data)
 
-            time += 1
+        graph = StepGraph.fromInstructions(data)
+        time, completedOrder = graph.schedule(workerPoolSize, durations, priority=self.priority)
 
         return time
 
-
 if __name__ == '__main__':
     day07 = Day07Solver()
     day07.Run()
@@ -1,41 +1,225 @@
-from utils import ProblemSolver
-
-
-class Node(object):
-    def __init__(self, name, numChildren, numMetaDatas, parent):
-        self.id = name
-        self.numMetaDatas = numMetaDatas
-        self.metaData = []
-        self.numChildren = numChildren
-        self.children = []
-        self.parent = parent
-
-    def getValue(self, nodes):
-        if not self.numChildren:
-            print('node ', self.id, 'has no children, returning metadata value', sum(self.metaData))
-            return sum(self.metaData)
-
-        else:
-            total = 0
-            print(self.metaData, self.children)
-            for childIndex in self.metaData:
-                if childIndex <= len(self.children):
-                    childIndex -= 1
-                    value = nodes[self.children[childIndex]].getValue(nodes)
-                    print('child index, ', childIndex, 'childID', self.children[childIndex], 'value ', value)
-                    total += value
+import array
+
+from utils import ProblemSolver, loadIntegers, parseIntegers, readIntegers
+
+
+class TreeSummary(object):
+    """
+    Just the answers about a tree, for when it's streamed in without keeping the nodes around
+    """
+    def __init__(self, metaDataTotal, rootValue):
+        self.total = metaDataTotal
+        self.rootValue = rootValue
+
+    def metaDataTotal(self):
+        """
+        :return: the sum of every node's metadata
+        """
+        return self.total
+
+    def getValue(self):
+        """
+        :return: the value of the root node
+        """
+        return self.rootValue
+
+    @classmethod
+    def stream(cls, ints):
+        """
+        Work out the metadata total and root value in one pass over the numbers, keeping only a stack of the nodes
+        that are still open. Each open node keeps how many children it has left to read, how much metadata it has,
+        and the values of the children it's finished, so memory depends on how deep the tree is, not how big
+
+        :param ints: iterable of the numbers in the input, like readIntegers or the int64 array from parseIntegers
+        :return: TreeSummary of the tree
+        """
+        if hasattr(ints, 'dtype'):
+            ints = memoryview(ints)
+
+        ints = iter(ints)
+        total = 0
+        rootValue = 0
+
+        try:
+            # [children left to read, number of metadata entries, values of the finished children]
+            stack = [[next(ints), next(ints), []]]
+
+            while stack:
+                frame = stack[-1]
+
+                if frame[0]:
+                    frame[0] -= 1
+                    stack.append([next(ints), next(ints), []])
+                    continue
+
+                stack.pop()
+                childValues = frame[2]
+                metaData = [next(ints) for _ in range(frame[1])]
+                total += sum(metaData)
+
+                if not childValues:
+                    value = sum(metaData)
+                else:
+                    value = sum(childValues[i - 1] for i in metaData if 0 < i <= len(childValues))
+
+                if stack:
+                    stack[-1][2].append(value)
+                else:
+                    rootValue = value
+        except StopIteration:
+            raise ValueError("input ended in the middle of a node") from None
+
+        return cls(total, rootValue)
+
+
+class Tree(object):
+    """
+    A tree of nodes stored as flat arrays indexed by node number, numbered in the order they appear in the input,
+    instead of an object with lists for every node. The root is node 0
+    """
+    def __init__(self):
+        # how many children and metadata entries each node has
+        self.childCount = array.array('i')
+        self.metaDataCount = array.array('i')
+
+        # a node's children are children[childStart[node]:childStart[node] + childCount[node]]
+        self.childStart = array.array('i')
+        self.children = array.array('i')
+
+        # a node's metadata is metaData[metaDataStart[node]:metaDataStart[node] + metaDataCount[node]]
+        self.metaDataStart = array.array('i')
+        self.metaData = array.array('q')
+
+        # every node's value, worked out the first time one is asked for
+        self.values = None
+
+    def __len__(self):
+        return len(self.childCount)
+
+    def metaDataTotal(self):
+        """
+        :return: the sum of every node's metadata
+        """
+        return sum(self.metaData)
+
+    def childrenOf(self, node):
+        """
+        :param node: node number
+        :return: array of the node numbers of the node's children, in order
+        """
+        start = self.childStart[node]
+        return self.children[start:start + self.childCount[node]]
+
+    def metaDataOf(self, node):
+        """
+        :param node: node number
+        :return: array of the node's metadata entries
+        """
+        start = self.metaDataStart[node]
+        return self.metaData[start:start + self.metaDataCount[node]]
+
+    def getValue(self, node=0):
+        """
+        A node with no children is worth the sum of its metadata, otherwise each metadata entry that points at one of
+        its children (starting from 1) adds that child's value
+
+        :param node: node number
+        :return: the value of the node
+        """
+        return self.nodeValues()[node]
+
+    def nodeValues(self):
+        """
+        Work out the value of every node exactly once, and keep them around for later.
+
+        Nodes are numbered in the order they appear, so every child has a bigger number than its parent, and going
+        through the nodes from the last one back to the first always gets to the children before their parent
+
+        :return: array of every node's value
+        """
+        if self.values is None:
+            values = array.array('q', [0]) * len(self)
+
+            for node in range(len(self) - 1, -1, -1):
+                metaData = self.metaDataOf(node)
+                numChildren = self.childCount[node]
+
+                if not numChildren:
+                    values[node] = sum(metaData)
                 else:
-                    print('childIndex', childIndex, 'is out of bounds of our children')
-            return total
+                    start = self.childStart[node]
+                    values[node] = sum(values[self.children[start + i - 1]] for i in metaData if 0 < i <= numChildren)
+
+            self.values = values
+
+        return self.values
+
+    @classmethod
+    def parse(cls, ints):
+        """
+        Parse the tree from the flat list of numbers, keeping an explicit stack of the nodes that still have children
+        left to read rather than recursing, so deep trees are fine
+
+        :param ints: sequence of the numbers in the input, like the int64 array from parseIntegers
+        :return: the parsed Tree
+        """
+        # read straight out of the array's buffer, where indexing gives back plain ints
+        if hasattr(ints, 'dtype'):
+            ints = memoryview(ints)
+
+        tree = cls()
+        pointer = 0
+
+        # children slots handed out so far, and how many children each node has filled in
+        nextChildSlot = 0
+        filled = array.array('i')
+
+        stack = []
+
+        def readHeader(parent):
+            nonlocal pointer, nextChildSlot
+
+            if pointer + 2 > len(ints):
+                raise ValueError("input ended in the middle of a node")
+
+            node = len(tree.childCount)
+            numChildren, numMetaDatas = ints[pointer], ints[pointer + 1]
+            pointer += 2
+
+            tree.childCount.append(numChildren)
+            tree.metaDataCount.append(numMetaDatas)
+            tree.childStart.append(nextChildSlot)
+            tree.metaDataStart.append(0)
+            filled.append(0)
+            nextChildSlot += numChildren
+            tree.children.extend([0] * numChildren)
+
+            if parent is not None:
+                tree.children[tree.childStart[parent] + filled[parent]] = node
+                filled[parent] += 1
+
+            stack.append(node)
+
+        readHeader(None)
 
-    def needsMetadata(self):
-        return len(self.metaData) < self.numMetaDatas
+        while stack:
+            node = stack[-1]
 
-    def childrenDiscovered(self):
-        return len(self.children) == self.numChildren
+            # if we haven't discovered all the children for the current node, the next number is a new node
+            if filled[node] < tree.childCount[node]:
+                readHeader(node)
+                continue
 
-    def __repr__(self):
-        return 'Node({}, {}, {}, {})>{}'.format(self.id, self.numChildren, self.numMetaDatas, self.parent, self.metaData)
+            # otherwise we've discovered all our children, so the next numbers are this node's metadata
+            stack.pop()
+            if pointer + tree.metaDataCount[node] > len(ints):
+                raise ValueError("input ended in the middle of a node")
+
+            tree.metaDataStart[node] = len(tree.metaData)
+            tree.metaData.extend(ints[pointer:pointer + tree.metaDataCount[node]])
+            pointer += tree.metaDataCount[node]
+
+        return tree
 
 
 class Day08Solver(ProblemSolver):
@@ -45,60 +229,28 @@ class Day08Solver(ProblemSolver):
         self.testDataPartOne = {'2 3 0 3 10 11 12 1 1 0 1 99 2 1 1 2': 138}
         self.testDataPartTwo = {'2 3 0 3 10 11 12 1 1 0 1 99 2 1 1 2': 66}
 
+        # set this to stream the input file through TreeSummary instead of building the whole Tree
+        self.streaming = False
+
+        # set this to memory map the input file instead of reading it when building the Tree
+        self.memoryMap = False
+
     def ProcessInput(self, data=None):
         """
         Parses the input tree string to determine each node's
-        children and metadata, ultimately building a flat list
+        children and metadata, ultimately building a Tree of flat arrays
         :param data:
-        :return:
+        :return: the Tree, or just its TreeSummary if we're streaming the input file
         """
 
         if not data:
-            data = self.rawData
+            if self.streaming:
+                with open(self.filePath, 'r') as fh:
+                    return TreeSummary.stream(readIntegers(fh))
 
-        nodes = {}
+            return Tree.parse(loadIntegers(self.filePath, memoryMap=self.memoryMap))
 
-        isNewID = True
-        isMetaData = False
-        currentNode = 0
-
-        pointer = 0
-        ints = [int(j) for j in data.split()]
-        while pointer < len(ints):
-            if isNewID:
-                # current node is up one from the
-                parent = currentNode
-                currentNode = len(nodes.keys()) + 1 # our new node is now one-up from the length of the list, since it's just an identifier
-
-                numChildren = ints[pointer]
-                numMetaDatas = ints[pointer + 1]
-
-                nodes[currentNode] = Node(currentNode, numChildren, numMetaDatas, parent)
-                if parent:
-                    nodes[parent].children.append(currentNode)
-
-                # move the pointer up two spots
-                pointer += 2
-
-            # if we've disocvered all our children, the current pointer index is probably metadata
-            if nodes[currentNode].childrenDiscovered():
-                isMetaData = True
-                isNewID = False
-            # if we haven't discovered all the children for the current node, the next pointer is going to be a new ID
-            else:
-                isNewID = True
-                isMetaData = False
-
-            # get all the metadata in one go
-            if isMetaData:
-                while nodes[currentNode].needsMetadata():
-                    nodes[currentNode].metaData.append(ints[pointer])
-                    pointer += 1
-
-                isMetaData = False
-                currentNode = nodes[currentNode].parent
-
-        return nodes
+        return Tree.parse(parseIntegers(data))
 
     def SolvePartOne(self, data=None):
         """
@@ -109,18 +261,13 @@ class Day08Solver(ProblemSolver):
         if not data:
             data = self.processed
 
-        flattenedList = sum([data[n].metaData for n in data], [])
-
-        return sum(flattenedList)
+        return data.metaDataTotal()
 
     def SolvePartTwo(self, data=None):
         if not data:
             data = self.processed
 
-        # for i in data:
-        #     print(i, data[i].children)
-
-        return data[1].getValue(data)
+        return data.getValue()
 
 if __name__ == '__main__':
     day08 = Day08Solver()
@@ -19,6 +19,149 @@ def product(iterable):
 
 
 
+def readIntegers(fh, blockSize=1 << 20):
+    """
+    Read whitespace separated integers from a file a block at a time, so the whole file never has to be in memory
+
+    :param fh: file object opened in text mode
+    :param blockSize: how many characters to read at a time
+    :return: generator of the integers in the file, in order
+    """
+    leftover = ''
+    block = fh.read(blockSize)
+    while block:
+        tokens = (leftover + block).split()
+
+        # the last number might carry on into the next block
+        leftover = ''
+        if tokens and not block[-1].isspace():
+            leftover = tokens.pop()
+
+        for token in tokens:
+            yield int(token)
+
+        block = fh.read(blockSize)
+
+    if leftover:
+        yield int(leftover)
+
+
+# the most digits a number can have and still be sure to fit in an int64
+MAX_INTEGER_DIGITS = 18
+
+
+def isWhitespace(chars):
+    """
+    :param chars: numpy array of bytes
+    :return: bool array of which bytes are ASCII whitespace
+    """
+    return (chars == ord(' ')) | ((chars >= ord('\t')) & (chars <= ord('\r')))
+
+
+def parseIntegerBlock(chars):
+    """
+    Pull every integer out of a block of text that starts at whitespace or the start of the input and doesn't
+    split any numbers. Works number by number rather than digit by digit, so the arrays it makes are only as long
+    as the number of numbers
+
+    :param chars: numpy array of the bytes in the block
+    :return: int64 numpy array of the numbers in the block, in order
+    """
+    import numpy
+
+    isDigit = ((chars >= ord('0')) & (chars <= ord('9'))).view(numpy.int8)
+
+    # find where each run of digits starts and stops
+    edges = numpy.flatnonzero(numpy.diff(isDigit, prepend=numpy.int8(0), append=numpy.int8(0)))
+    starts, stops = edges[::2], edges[1::2]
+    lengths = stops - starts
+
+    if len(lengths) and lengths.max() > MAX_INTEGER_DIGITS:
+        raise ValueError("Found a number with {} digits, more than the {} that fit in an int64".format(
+            lengths.max(), MAX_INTEGER_DIGITS))
+
+    # build every number up a digit at a time, only the numbers that still have digits left take part each time
+    numbers = numpy.zeros(len(starts), dtype=numpy.int64)
+    for place in range(int(lengths.max()) if len(lengths) else 0):
+        hasDigit = lengths > place
+        numbers[hasDigit] = numbers[hasDigit] * 10 + (chars[starts[hasDigit] + place] - ord('0'))
+
+    # a minus sign only makes a number negative if it's at the start of the token, so 9-8 isn't 9 and -8
+    signs = starts - 1
+    hasSign = signs >= 0
+    hasSign[hasSign] = chars[signs[hasSign]] == ord('-')
+
+    beforeSign = signs - 1
+    tokenStart = hasSign & (beforeSign < 0)
+    checkBefore = hasSign & (beforeSign >= 0)
+    tokenStart[checkBefore] = isWhitespace(chars[beforeSign[checkBefore]])
+
+    numbers[tokenStart] *= -1
+
+    return numbers
+
+
+def parseIntegers(buffer, blockSize=1 << 20):
+    """
+    Pull every integer out of some text with numpy array operations, rather than making a string and an int for
+    every token. Anything that isn't a digit, or a minus sign at the start of a token, just separates the numbers.
+
+    The text is worked through in blocks of about blockSize bytes, each cut off at the next whitespace so no
+    number is split, so memory use depends on the block size and not on how big the text is
+
+    :param buffer: the text as a str, bytes, or an array of bytes, like a numpy.memmap of a file
+    :param blockSize: roughly how many bytes to parse at a time
+    :return: int64 numpy array of the numbers in the text, in order
+    """
+    # only the days that read their input this way need numpy
+    import numpy
+
+    if isinstance(buffer, str):
+        buffer = buffer.encode('ascii')
+
+    chars = numpy.frombuffer(buffer, dtype=numpy.uint8) if not isinstance(buffer, numpy.ndarray) else buffer
+
+    blocks = []
+    start = 0
+    while start < len(chars):
+        # carry on to the next whitespace, so the next block starts between two tokens
+        stop = min(start + blockSize, len(chars))
+        while stop < len(chars):
+            window = chars[stop:stop + blockSize]
+            spaces = numpy.flatnonzero(isWhitespace(window))
+            if len(spaces):
+                stop += int(spaces[0])
+                break
+            stop += len(window)
+
+        blocks.append(parseIntegerBlock(numpy.asarray(chars[start:stop])))
+        start = stop
+
+    if not blocks:
+        return numpy.zeros(0, dtype=numpy.int64)
+
+    return numpy.concatenate(blocks)
+
+
+def loadIntegers(filePath, memoryMap=False):
+    """
+    Read every integer in a file straight into a numpy array, without ever making a Python string of the file
+
+    :param filePath: path to the file
+    :param memoryMap: map the file into memory instead of reading it, so besides the numbers themselves only about
+        one block of the file's worth of working memory is needed, see parseIntegers
+    :return: int64 numpy array of the numbers in the file, in order
+    """
+    import numpy
+
+    if memoryMap:
+        chars = numpy.memmap(filePath, dtype=numpy.uint8, mode='r')
+    else:
+        chars = numpy.fromfile(filePath, dtype=numpy.uint8)
+
+    return parseIntegers(chars)
+
+
 def getInputsFolder():
     """
 
@@ -39,17 +182,16 @@ class ProblemSolver(object):
     """
     def __init__(self, day):
         """
-        Finds the input data file for this day, and loads the raw contents of that file into
-        the rawData property of the instance
+        Finds the input data file for this day. The raw contents of that file are loaded into
+        the rawData property of the instance the first time it's accessed
         :param day: the number day for this data
         """
         self.day = day
         self.fileName = 'day{}.txt'.format(str(day).zfill(2))
         self.filePath = os.path.join(getInputsFolder(), self.fileName)
 
-        # load in the file's data
-        with open(self.filePath, 'r') as fh:
-            self.rawData = fh.read()
+        # the file's data is loaded lazily, so solvers that stream the file don't have to hold all of it
+        self._rawData = None
 
         # leave this open for later access by process input
         self.processed = None
@@ -59,6 +201,17 @@ class ProblemSolver(object):
         self.testDataPartOne = {}
         self.testDataPartTwo = {}
 
+    @property
+    def rawData(self):
+        """
+        :return: the raw contents of this day's input file, read in the first time it's needed
+        """
+        if self._rawData is None:
+            with open(self.filePath, 'r') as fh:
+                self._rawData = fh.read()
+
+        return self._rawData
+
     def ProcessInput(self, data=None):
         """
         To be implemented by each day's class to process data into a helpful format